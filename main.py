@@ -1,4 +1,5 @@
-from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from ui import RcUI
 from model import ReCon
 from CTkMessagebox import CTkMessagebox
@@ -17,8 +18,15 @@ class App:
     def __init__(self):
         self.logic = None
         self.ui = None
+        # long running model operations are run by a persistent pool instead of a new thread per ui action
+        self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="recon")
+        # found nodes are collected and added to the listbox in batches to avoid a redraw per node
+        self._node_batch = []
+        self._node_flush_scheduled = False
         self.init_logic()
         self.init_ui()
+        # model events are raised from worker threads, post their handlers to the ui thread as Tk is not thread-safe
+        self.logic.set_dispatcher(self.ui.after)
 
     def init_logic(self):
         # init model, restoring host data if available
@@ -34,6 +42,7 @@ class App:
         self.logic.bind("consoles_loaded", self.on_model_consoles_loaded)
         self.logic.bind("local_networks_loaded", self.on_model_local_networks_loaded)
         self.logic.bind("node_found", self.on_model_node_found)
+        self.logic.bind("nodes_batch", self.on_model_nodes_batch)
         self.logic.bind("nodes_loaded", self.on_model_nodes_loaded)
         self.logic.bind("tunnel_established", self.on_model_tunnel_established)
         self.logic.bind("tunnel_closed", self.on_model_tunnel_closed)
@@ -46,6 +55,9 @@ class App:
         self.ui.frames["login"].cmbx_sshosts.configure(command=self.on_ui_cmbx_sshosts_change)
         self.ui.frames["login"].txt_password.bind("<KeyRelease>", self.on_ui_txt_password_keyrelease)
         self.ui.frames["login"].btn_connect.configure(command=self.on_ui_btn_connect_click)
+
+    def init_devices_frame(self):
+        # devices frame is created on its first use, bind its events then
         self.ui.frames["devices"].btn_spawn_shell.configure(command=self.on_ui_btn_spawn_shell)
         self.ui.frames["devices"].btn_consoles_refresh.configure(command=self.on_ui_btn_consoles_refresh)
         self.ui.frames["devices"].btn_spawn_console.configure(command=self.on_ui_btn_spawn_console)
@@ -53,6 +65,12 @@ class App:
         self.ui.frames["devices"].btn_nodes_refresh.configure(command=self.on_ui_btn_nodes_refresh)
         self.ui.frames["devices"].btn_tunnel_https.configure(command=self.on_ui_btn_node_tunnel_https)
 
+    def submit(self, fn, *args, on_error=None):
+        """Run fn on the executor. If it raises, the error is logged and reported, then on_error is called if given."""
+        future = self.executor.submit(fn, *args)
+        future.add_done_callback(partial(self.on_task_done, on_error=on_error))
+        return future
+
     def start(self):
         self.logic.start()
         self.ui.start()  # starts ui mainloop and doesn't return till exit click
@@ -61,8 +79,24 @@ class App:
     # Event handlers
     # app
     def on_stop(self):
+        self.executor.shutdown(wait=False)
         self.logic.stop()
 
+    def on_task_done(self, future, on_error=None):
+        """Triggered in the worker thread when a task run by submit() is completed"""
+        if future.cancelled() or future.exception() is None:
+            return
+        error = future.exception()
+        logger.error(f"{type(error).__name__} occured in background task. {error}", exc_info=error)
+        # report it on the ui thread as Tk is not thread-safe
+        self.ui.after(0, self.on_task_error, error, on_error)
+
+    def on_task_error(self, error, on_error):
+        """Triggered when a task run by submit() raised an error"""
+        self.ui.set_status(f"Failed! ({error})", True)
+        if on_error:
+            on_error()
+
     def on_model_initialize(self):
         """Triggered when the model initialized in the start() method"""
         if len(self.logic.host_pool):
@@ -70,10 +104,10 @@ class App:
             values = tuple(h.address for h in self.logic.host_pool.values())
             self.ui.frames["login"].cmbx_sshosts.configure(values=values)
             
-            # get the first host from host_pool dictionary and set username and address
-            first_host = next(iter(self.logic.host_pool.values()))            
-            self.ui.frames["login"].txt_username.insert(0, first_host.username)
-            self.ui.frames["login"].cmbx_sshosts.set(first_host.address)
+            # get the last connected host, or the first host from host_pool dictionary and set username and address
+            last_host = self.logic.current_host or next(iter(self.logic.host_pool.values()))
+            self.ui.frames["login"].txt_username.insert(0, last_host.username)
+            self.ui.frames["login"].cmbx_sshosts.set(last_host.address)
         else:
             # if there's no host in host_pool, set the current user as username
             self.ui.frames["login"].txt_username.insert(0, os.getlogin())
@@ -92,6 +126,8 @@ class App:
             # if the connection is established, update the title with the current host info and show the devices frame
             self.ui.set_connection_info_at_title(self.logic.current_host.username, self.logic.current_host.address)
             self.ui.set_status("Connection established!")
+            if "devices" not in self.ui.frames:
+                self.init_devices_frame()
             self.ui.show("devices")
         else:
             # if not, show the error message and enable the login frame controls again.
@@ -118,14 +154,31 @@ class App:
                                         "Do you want to proceed?",
                                 icon="question", option_1="No", option_2="Yes")
             if msg.get() == "Yes":
-                Thread(target=self.logic.enumerate_nodes).start()
+                self.submit(self.logic.enumerate_nodes)
 
     def on_model_node_found(self, node):
         """Triggered when a node is found"""
-        self.ui.frames["devices"].add_lbx_node(node)
+        self._node_batch.append(node)
+        if not self._node_flush_scheduled:
+            self._node_flush_scheduled = True
+            self.ui.after(50, self._flush_nodes)
+
+    def on_model_nodes_batch(self, nodes):
+        """Triggered when multiple nodes are found at once"""
+        self._node_batch.extend(nodes)
+        self._flush_nodes()
+
+    def _flush_nodes(self):
+        """Add the nodes collected since the last flush to the listbox at once"""
+        nodes, self._node_batch = self._node_batch, []
+        self._node_flush_scheduled = False
+        if nodes:
+            self.ui.frames["devices"].add_lbx_nodes(nodes)
 
     def on_model_nodes_loaded(self):
         """Triggered when node loading completed (either from cache or by scanning)"""
+        # make sure that all the found nodes are in the listbox before tunneling is enabled for them
+        self._flush_nodes()
         self.ui.set_status(f"Nodes loaded.")
 
         # reactivate the refresh button and tunnel buttons
@@ -137,17 +190,18 @@ class App:
         # if the tunnel is established, extend the listbox with the port mapping and double click handler
         # double click handler will open the browser with the url
         self.ui.frames["devices"].extend_lbx_nodes(port_mapping, handler=self.on_ui_lbx_node_double_click)
-        self.ui.frames["devices"].btn_tunnel_https.configure(text="Close tunnel")
+        self.ui.frames["devices"].btn_tunnel_https.configure(text="Close tunnel", state="normal")
         self.ui.set_status(f"Tunnel established!")
 
     def on_model_tunnel_closed(self):
         """Triggered when the model has closed the ssh tunnel"""
-        self.ui.frames["devices"].btn_tunnel_https.configure(text="Tunnel HTTPS")
+        self.ui.frames["devices"].btn_tunnel_https.configure(text="Tunnel HTTPS", state="normal")
         self.ui.set_status(f"Tunnel closed!")
 
     # ui
     def on_ui_cmbx_sshosts_change(self, arg):
         """Triggered when the host combobox selection changes"""
+        self.logic.load_host(arg)
         # update the username field with the selected host's username if available
         prev_username = self.ui.frames["login"].txt_username.get()
         if prev_username:
@@ -173,7 +227,9 @@ class App:
             return
         # otherwise, disable the login frame controls and start the setup process
         self.ui.frames["login"].set_accessibility("disabled")
-        Thread(target=self.logic.setup, args=(host, username, password)).start()
+        # if the setup fails, the login frame controls are enabled again to let the user retry
+        self.submit(self.logic.setup, host, username, password,
+                    on_error=partial(self.ui.frames["login"].set_accessibility, "normal"))
 
     def on_ui_btn_spawn_shell(self):
         """Triggered when the spawn shell button is clicked"""
@@ -203,10 +259,14 @@ class App:
         """Triggered when the refresh nodes button is clicked"""
         self.logic.clear_nodes()
         self.ui.frames["devices"].empty_lbx_nodes()
-        Thread(target=self.logic.enumerate_nodes).start()
+        self.submit(self.logic.enumerate_nodes)
 
     def on_ui_btn_node_tunnel_https(self):
-        self.logic.toggle_https_tunnel()
+        # the tunnel is checked for a while after it is started, so it is toggled in the background.
+        # the button is disabled till it is toggled, and enabled again if it fails.
+        btn_tunnel_https = self.ui.frames["devices"].btn_tunnel_https
+        btn_tunnel_https.configure(state="disabled")
+        self.submit(self.logic.toggle_https_tunnel, on_error=partial(btn_tunnel_https.configure, state="normal"))
 
 if __name__ == "__main__":
     logger.info("Application started.")
@@ -1,14 +1,22 @@
-import paramiko
-from paramiko.ssh_exception import *
 import logging
 import sys
 import socket
-from ipaddress import IPv4Network
+import select
+from ipaddress import IPv4Address, IPv4Interface, IPv4Network
 import re
 import subprocess
-import tempfile
 import os
+import json
 import pickle
+import hashlib
+import uuid
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field, asdict
+from threading import Event, Lock, Thread
+from functools import partial
+from itertools import chain, islice
 import util
 
 logger = logging.getLogger("recon.model")
@@ -17,22 +25,113 @@ logger = logging.getLogger("recon.model")
 
 strList = list[str]
 
+# matches IPv4 address and subnet mask pairs of the interfaces in ipconfig output
+_IPCONFIG_RE = re.compile(r"IPv4 Address\D+(\d+\.\d+\.\d+\.\d+)\r\s+Subnet Mask\D+(\d+\.\d+\.\d+\.\d+)")
+# characters not allowed in file names on Windows, replaced in the names of host data files
+_UNSAFE_FILENAME_RE = re.compile(r'[\\/:*?"<>|]')
+# private (RFC 1918) address ranges as (first, last) integer pairs. Only networks in them are scanned,
+# which also leaves out loopback and link-local addresses.
+_PRIVATE_RANGES = tuple((int(network.network_address), int(network.broadcast_address))
+                        for network in map(IPv4Network, ("10.0.0.0/8", "172.16.0.0/12", "192.168.0.0/16")))
+# matches the port name in a serial console caption like 'USB to UART Bridge (COM6)'
+_COM_RE = re.compile(r"(COM\d+)")
+# matches IPv4 addresses of the dynamic entries in arp -a output
+_ARP_RE = re.compile(r"(\d+\.\d+\.\d+\.\d+)\s+[\da-f-]{17}\s+dynamic")
+
+@dataclass(slots=True)
+class HostInfo:
+    """
+    Represents information about a host.
+    This class instances will be added to host_pool and saved to the disk.
+    Attributes:
+        address (str): The address of the host.
+        username (str): The username associated with the host.
+        active (bool): Indicates if the host is active.
+        consoles (list): A list of consoles associated with the host.
+        networks (list): A list of networks associated with the host, as the interface address of the host
+            and the prefix length of the network (e.g. 192.168.1.10/24).
+        nodes (list): A list of nodes associated with the host.
+    """
+    address: str
+    username: str
+    active: bool = True
+    consoles: strList = field(default_factory=list)
+    networks: strList = field(default_factory=list)
+    nodes: strList = field(default_factory=list)
+
+    def to_dict(self):
+        """Return a json serializable dictionary of the host info."""
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data):
+        """Create a host info from a dictionary returned by to_dict. Raise ValueError if the data doesn't fit the fields."""
+        try:
+            host = cls(**data)
+        except TypeError as e:
+            raise ValueError(f"Invalid host data: {e}") from e
+        if not (isinstance(host.address, str) and isinstance(host.username, str) and isinstance(host.active, bool)
+                and all(isinstance(item, str) for item in chain(host.consoles, host.networks, host.nodes))):
+            raise ValueError(f"Invalid host data for {host.address}")
+        return host
+
+
+def _ip_to_int(ip: str):
+    """Convert a dotted quad IPv4 address to an integer."""
+    return int.from_bytes(socket.inet_aton(ip), "big")
+
+
+def _int_to_ip(ip: int):
+    """Convert an integer to a dotted quad IPv4 address."""
+    return f"{ip >> 24}.{(ip >> 16) & 255}.{(ip >> 8) & 255}.{ip & 255}"
+
+
+def _iter_hosts(network: IPv4Network):
+    """Yield the host addresses of the network as strings, without building an IPv4Address object for each."""
+    # /31 and /32 networks don't have network and broadcast addresses to exclude
+    if network.prefixlen >= 31:
+        yield from map(str, network.hosts())
+        return
+    for ip in range(int(network.network_address) + 1, int(network.broadcast_address)):
+        yield _int_to_ip(ip)
+
+
+class _LegacyHostInfo:
+    """Stand-in for the host info class of the older versions, to read the pickled host data they saved."""
+
+
+class _LegacyUnpickler(pickle.Unpickler):
+    """Unpickler of the host data file of the older versions, which only resolves the classes that file can contain."""
+    CLASSES = {("model", "ReCon.HostInfo"): _LegacyHostInfo, ("ipaddress", "IPv4Network"): IPv4Network}
+
+    def find_class(self, module, name):
+        if (module, name) not in self.CLASSES:
+            raise pickle.UnpicklingError(f"Unexpected class {module}.{name} in legacy host data")
+        return self.CLASSES[(module, name)]
+
+
 class ReCon:
     """
     The ReCon class represents a tool for remote reconnaissance and management of hosts.
     Attributes:
-        HOST_DATA_PATH (str): The file path to store the host data.
+        HOST_DATA_PATH (str): The directory path to store the host data, one file per host.
+        HOST_INDEX_PATH (str): The file path to store the addresses and usernames of the hosts and the last connected one.
+        LEGACY_HOST_DATA_PATH (str): The file path the older versions pickled the host data to, imported once if found.
+        KEY_PATH (str): The file path to store the private key deployed to the hosts, under the user profile.
     Methods:
         __init__(): Initializes a new instance of the ReCon class.
         restore_host_data(): Restores the host data from the file.
         save_host_data(): Saves the host data to the file.
+        load_host(address): Loads the details of a host from its file.
         bind(event, handler): Binds an event to a handler function.
+        set_dispatcher(dispatcher): Sets the function that event handlers are posted to.
         call_handler(handler, **kwargs): Calls the specified handler function with the given arguments.
         start(): Starts the ReCon tool.
         connect(host, username, password): Connects to a host using SSH.
         activity(msg): Logs an activity message.
         fill_prompt(): Fills the prompt with initial data from the SSH channel.
         execute_command(command): Executes a command on the connected host.
+        stream_command(command): Executes a command on the connected host and yields its output lines.
         clear_consoles(): Clears the list of consoles.
         enumerate_consoles(): Enumerates the available consoles on the host.
         clear_local_networks(): Clears the list of local networks.
@@ -40,54 +139,100 @@ class ReCon:
         clear_nodes(): Clears the list of nodes.
         enumerate_nodes(): Enumerates the available nodes on the host.
         toggle_https_tunnel(): Toggles the HTTPS tunnel for the nodes.
-        deploy_key(): Deploys the RSA key to the host.
+        deploy_key(): Deploys the Ed25519 key to the host.
         spawn_console(console): Spawns a console for the specified console name.
         spawn_shell(): Spawns a shell console.
         stop(): Stops the ReCon tool and closes connections.
         setup(host, username, password): Sets up the ReCon tool for the specified host.
     """
     
-    HOST_DATA_PATH = util.get_dyn_path("user/hosts.dat")
-
-    class HostInfo:
-        """
-        Represents information about a host.
-        This class instances will be added to host_pool and saved to the disk.
-        Attributes:
-            address (str): The address of the host.
-            username (str): The username associated with the host.
-            active (bool): Indicates if the host is active.
-            consoles (list): A list of consoles associated with the host.
-            networks (list): A list of networks associated with the host.
-            nodes (list): A list of nodes associated with the host.
-        """
-        def __init__(self, address: str, username: str):
-            self.address: str = address
-            self.username: str = username
-            self.active: bool = True
-            self.consoles: strList = []
-            self.networks: strList = []
-            self.nodes: strList = []
+    # instance attributes are fixed, so they are kept in slots instead of a per instance dict
+    __slots__ = ("_ssh_client", "_sftp_client", "_ssh_tunnel_proc", "_shell_pool",
+                 "_key_file", "_key_executor", "_key_future", "ssh_key", "_event_handlers", "_dispatcher",
+                 "host_pool", "current_host", "_active_key", "_loaded_hosts", "_dirty_hosts", "_file_digests", "_save_event", "_save_lock", "_write_lock", "_prompt")
+
+    HOST_DATA_PATH = util.get_dyn_path("user/hosts")
+    HOST_INDEX_PATH = util.get_dyn_path("user/hosts_index.json")
+    LEGACY_HOST_DATA_PATH = util.get_dyn_path("user/hosts.dat")
+    # the key is kept in the .ssh directory of the user profile, as ssh refuses a key file readable by other users.
+    KEY_PATH = os.path.join(os.path.expanduser("~"), ".ssh", "recon_id_ed25519")
+    # legacy SHA-1 based host key and key exchange algorithms are never negotiated.
+    # paramiko already prefers curve25519/ECDH key exchange and ed25519/ECDSA host keys over the remaining ones.
+    DISABLED_ALGORITHMS = {
+        "keys": ["ssh-rsa", "ssh-dss"],
+        "kex": ["diffie-hellman-group1-sha1", "diffie-hellman-group14-sha1", "diffie-hellman-group-exchange-sha1"],
+    }
+    # commands listing the serial consoles and the network interfaces of the host.
+    # a single CIM query prints the captions only, one per line. It starts much faster than the deprecated wmic.
+    # its stdin is redirected from NUL, otherwise powershell would read the following lines sent to the shell.
+    CONSOLES_COMMAND = 'powershell -NoProfile -Command "Get-CimInstance Win32_SerialPort | Select-Object -ExpandProperty Caption" <NUL'
+    NETWORKS_COMMAND = "ipconfig"
+    # seconds to wait for a command run on a shell to complete. The shell is closed if it doesn't.
+    SHELL_TIMEOUT = 30
+    # seconds the tunnel process must keep running after it is started to be considered as established
+    TUNNEL_CHECK_DELAY = 2
+    # flow control window and max packet size of the opened channels
+    CHANNEL_WINDOW_SIZE = 2 * 1024 * 1024
+    CHANNEL_MAX_PACKET_SIZE = 32 * 1024
+    # saves requested within this many seconds are written to the disk at once
+    SAVE_DELAY = 0.25
+    # timeout in milliseconds for a single ping during node enumeration. All pings are in flight at the same time.
+    PING_TIMEOUT = 250
+    # number of hosts pinged by a single remote command
+    SWEEP_CHUNK = 64
+    # number of chunks swept at the same time. Each one takes a channel and sshd allows 10 per connection by default
+    # (MaxSessions), one of which is the persistent shell.
+    SWEEP_WORKERS = 8
+    # networks larger than this prefix are not swept entirely, only their subnet of this prefix that the host is in
+    MAX_SWEEP_PREFIX = 24
 
     def __init__(self):
         # For some of SSH connections we'll use paramiko and for some we'll use subprocess and ssh util.
-        self._ssh_client = paramiko.SSHClient()
+        # paramiko is imported on the first connection, so the client is created then.
+        self._ssh_client = None
         self._sftp_client = None
         self._ssh_tunnel_proc = None
 
-        # After connecting to a host using credentials, we'll generate a key and deploy it to the host for the further operations. 
+        # commands are sent to long lived shells instead of opening a new channel per command.
+        # idle shells are kept in the pool, a shell is taken out while a command is running on it.
+        self._shell_pool: queue.Queue = queue.Queue()
+
+        # After connecting to a host using credentials, we'll deploy a key to the host for the further operations. 
         self._key_file: str = None
+        # the key is cached on the disk. It is loaded, or generated on the first run, while the user is typing credentials.
+        self._key_executor = ThreadPoolExecutor(max_workers=1)
+        self._key_future = self._key_executor.submit(self._load_key)
 
         # event handlers are stored in a dictionary with event names as keys and handler functions as values
         self._event_handlers: dict[str, callable] = {}
 
+        # handlers are mostly called from worker threads. If a dispatcher like Tk's after() is set,
+        # they are posted through it so that they run on the ui thread.
+        self._dispatcher: callable = None
+
         # we'll save each host info to the disk and restore it when the tool is started again.
         # this way, recent host connections will be loaded automatically.
         # A host is added to the host_pool when it is connected successfully.
-        self.host_pool: dict[str,self.HostInfo] = {}
+        self.host_pool: dict[str,HostInfo] = {}
 
         # as there may be muliple hosts in the pool, we'll keep track of the current host.
+        # its address is saved too, so that the last connected host is the current one when the tool is started again.
         self.current_host = None
+        self._active_key: str = None
+
+        # only the index of the hosts is read on start, addresses of the hosts with all the details read are kept here.
+        self._loaded_hosts: set[str] = set()
+
+        # host data is written to the disk by a background thread, so that multiple changes in a short time are saved once.
+        # only the hosts changed since the last write are saved, each one to its own file.
+        self._dirty_hosts: set[str] = set()
+        # digests of the json files as last read or written, to skip writing a file with unchanged content
+        self._file_digests: dict[str, bytes] = {}
+        self._save_lock = Lock()
+        # held during a whole flush, so that stop() waits for a write of the saver thread instead of racing with it
+        self._write_lock = Lock()
+        self._save_event = Event()
+        Thread(target=self._save_loop, name="recon-save", daemon=True).start()
 
         # try to restore host data from the disk if exists
         self._restore_host_data()
@@ -95,93 +240,255 @@ class ReCon:
         # prompt is to ensure that we're connected to the right host
         self._prompt = ""
 
+    def _host_data_path(self, address):
+        """Return the path of the json file that stores the data of the host with the given address."""
+        # characters which can't be in a file name, like the colons of IPv6 addresses, are replaced
+        return os.path.join(self.HOST_DATA_PATH, f"{_UNSAFE_FILENAME_RE.sub('_', address)}.json")
+
+    def _write_json(self, path, data):
+        """
+        Write the data to the json file through a temporary file, so that the file is never left half written.
+        The write is skipped if the file already has the same content.
+        """
+        content = json.dumps(data).encode('utf-8')
+        digest = hashlib.blake2b(content, digest_size=16).digest()
+        if self._file_digests.get(path) == digest:
+            return
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'wb') as file:
+            file.write(content)
+        os.replace(temp_path, path)
+        self._file_digests[path] = digest
+
+    def _read_json(self, path):
+        """Read the data from the json file and remember its digest for _write_json."""
+        with open(path, 'rb') as file:
+            content = file.read()
+        self._file_digests[path] = hashlib.blake2b(content, digest_size=16).digest()
+        return json.loads(content)
+
     def _restore_host_data(self):
-        """Restore the host data from the pickled file."""
-        if not os.path.isfile(self.HOST_DATA_PATH):
+        """Restore the host index from the json file. Details of a host are loaded by load_host when they are needed."""
+        try:
+            index = self._read_json(self.HOST_INDEX_PATH)
+            host_pool = {address: HostInfo.from_dict({"address": address, "username": entry["username"], "active": entry["active"]})
+                         for address, entry in index["hosts"].items()}
+            # the last connected host is restored as the current one
+            active_key = index["active"]
+            current_host = host_pool.get(active_key)
+        except FileNotFoundError:
+            self._import_legacy_host_data()
+            return
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            # a broken index only loses the known hosts, like a broken host file only loses its details in load_host
+            logger.warning(f"Host index can't be loaded, starting without the known hosts. {e!r}")
             return
-        with open(self.HOST_DATA_PATH, 'rb') as file:
-            # Deserialize and retrieve the variable from the file
-            self.host_pool = pickle.load(file)
+        self.host_pool.update(host_pool)
+        self._active_key = active_key
+        self.current_host = current_host
+
+    def _import_legacy_host_data(self):
+        """Import the hosts from the pickle file saved by the older versions into the json files, then remove it."""
+        try:
+            with open(self.LEGACY_HOST_DATA_PATH, 'rb') as file:
+                legacy_pool = _LegacyUnpickler(file).load()
+            for address, host in legacy_pool.items():
+                data = {"address": host.address, "username": host.username, "active": host.active, "consoles": host.consoles,
+                        "networks": [str(network) for network in host.networks], "nodes": host.nodes}
+                self.host_pool[address] = HostInfo.from_dict(data)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            # the file is left in place, hosts can still be connected and saved as new ones
+            logger.warning(f"Legacy host data can't be imported. {e}")
+            self.host_pool.clear()
+            return
+
+        self._loaded_hosts.update(self.host_pool)
+        with self._save_lock:
+            self._dirty_hosts.update(self.host_pool)
+        self._flush_host_data()
+        # the pickle file is removed only if all the hosts are written to the json files
+        if not self._dirty_hosts:
+            os.remove(self.LEGACY_HOST_DATA_PATH)
+
+    def load_host(self, address):
+        """Load the consoles, networks and nodes of a host in the pool from its json file if not loaded yet."""
+        with self._save_lock:
+            if address in self._loaded_hosts or address not in self.host_pool:
+                return
+            self._loaded_hosts.add(address)
+            try:
+                self.host_pool[address] = HostInfo.from_dict(self._read_json(self._host_data_path(address)))
+            except FileNotFoundError:
+                pass
+            except ValueError as e:
+                # a broken file only loses the cached details, the host will be enumerated again
+                logger.warning(f"Host data of {address} can't be loaded. {e}")
 
     def _save_host_data(self):
-        """Save the host data to the pickle file."""
-        os.makedirs(os.path.dirname(self.HOST_DATA_PATH), exist_ok=True)
-        # Open the file in binary mode
-        with open(self.HOST_DATA_PATH, 'wb') as file:
-            # Serialize and write the variable to the file
-            pickle.dump(self.host_pool, file)
+        """Mark the current host data as changed and schedule writing it to the disk."""
+        with self._save_lock:
+            self._dirty_hosts.add(self.current_host.address)
+        self._save_event.set()
+
+    def _save_loop(self):
+        """Write the changed host data in the background, changes requested within SAVE_DELAY are written together."""
+        while True:
+            self._save_event.wait()
+            time.sleep(self.SAVE_DELAY)
+            self._save_event.clear()
+            # an unexpected error must not stop the thread, otherwise nothing would be saved for the rest of the session
+            try:
+                self._flush_host_data()
+            except Exception:
+                logger.exception("Host data can't be saved.")
+
+    def _flush_host_data(self):
+        """
+        Write the data of each host changed since the last write to its own json file.
+        If writing fails, the error is logged and the hosts are kept as changed to be written with the next save.
+        """
+        with self._write_lock:
+            with self._save_lock:
+                if not self._dirty_hosts:
+                    return
+                addresses = set(self._dirty_hosts)
+                data = [self.host_pool[address].to_dict() for address in addresses]
+                self._dirty_hosts.clear()
+                # the index is small and it is rewritten with any host change, new hosts must be listed in it anyway.
+                index = {"active": self._active_key,
+                         "hosts": {address: {"username": host.username, "active": host.active} for address, host in self.host_pool.items()}}
+
+            try:
+                os.makedirs(self.HOST_DATA_PATH, exist_ok=True)
+                for host_data in data:
+                    self._write_json(self._host_data_path(host_data["address"]), host_data)
+                self._write_json(self.HOST_INDEX_PATH, index)
+            except OSError as e:
+                # e.g. the file may be held by an antivirus or indexer for a moment on Windows
+                logger.error(f"Host data can't be saved. {e}")
+                with self._save_lock:
+                    self._dirty_hosts |= addresses
 
     def _call_handler(self, handler, **kwargs):
-        """Call the specified handler function with the given arguments."""
+        """Call the specified handler function with the given arguments, through the dispatcher if it is set."""
         if handler in self._event_handlers:
-            self._event_handlers[handler](**kwargs)
+            if self._dispatcher:
+                self._dispatcher(0, partial(self._event_handlers[handler], **kwargs))
+            else:
+                self._event_handlers[handler](**kwargs)
 
     def _activity(self, msg):
         """Log an activity message and call the activity handler."""
         logger.info(msg)
         self._call_handler("activity", msg=msg)
 
+    def _open_channel(self):
+        """Open a session channel with a large window, so that outputs are received without waiting for window adjustments."""
+        return self._ssh_client.get_transport().open_session(window_size=self.CHANNEL_WINDOW_SIZE,
+                                                             max_packet_size=self.CHANNEL_MAX_PACKET_SIZE)
+
     def _fill_prompt(self):
         # open a session on the SSH channel
-        channel = self._ssh_client.get_transport().open_session()
-        channel.settimeout(2)
+        channel = self._open_channel()
         prompt = ""
 
         # read the initial data if available. This will be prompt
-        try:
+        # wait for it only shortly instead of blocking on recv, so that servers sending nothing don't delay the login.
+        readable, _, _ = select.select([channel], [], [], 0.2)
+        if readable and channel.recv_ready():
             prompt = channel.recv(1024).decode('utf-8')
-        except socket.timeout:
-            pass
         channel.close()
         self._prompt = prompt          
 
+    def _load_key(self):
+        """Load the cached Ed25519 key, or generate one and cache it for the next runs."""
+        # paramiko and cryptography take a while to import, they are imported here in the background
+        # instead of at the module load, so that the ui shows up without waiting for them.
+        import paramiko
+        if not os.path.isfile(self.KEY_PATH):
+            from cryptography.hazmat.primitives import serialization
+            from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+            # paramiko can't generate Ed25519 keys, so the key is generated by cryptography in OpenSSH format
+            private_key = Ed25519PrivateKey.generate()
+            os.makedirs(os.path.dirname(self.KEY_PATH), exist_ok=True)
+            with os.fdopen(os.open(self.KEY_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as file:
+                file.write(private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.OpenSSH,
+                                                     serialization.NoEncryption()))
+        return paramiko.Ed25519Key(filename=self.KEY_PATH)
+
     def _deploy_key(self):
         """
-        Generate and deploy a RSA key to the host. The public part of the key will be
-        saved to the remote host authorized_keys file.
+        Deploy the cached Ed25519 key to the host. The public part of the key will be
+        saved to the remote host authorized_keys file unless it is already there.
         """
 
-        # generate a RSA key
-        self.rsa_key = rsa_key = paramiko.RSAKey.generate(bits=2048)
-        key_name= rsa_key.get_name()
+        # get the key which is loaded or generated in the background since the start
+        self.ssh_key = ssh_key = self._key_future.result()
+        key_name= ssh_key.get_name()
+        self._key_file = self.KEY_PATH
 
         # get the base64 encoded public key
-        key = rsa_key.get_base64()
+        key = ssh_key.get_base64()
 
-        # create a temporary file and dump the private key to it
-        key_fd, self._key_file = tempfile.mkstemp()
-        os.close(key_fd)
-        rsa_key.write_private_key_file(self._key_file)
+        # the key is reused across sessions, so it is probably deployed already. findstr exits with 0 if it is found.
+        # findstr can't search strings longer than 127 bytes, the tail of the key is distinctive enough.
+        authorized_keys = f'C:\\Users\\{self.current_host.username}\\.ssh\\authorized_keys'
+        _, _, code = self.execute_command(f'findstr /C:"{key[-64:]}" "{authorized_keys}" >NUL')
+        if code == 0:
+            return
 
         # deploy the public key to the remote host
-        command = f'echo {key_name} {key} > C:\\Users\\{self.current_host.username}\\.ssh\\authorized_keys'
-        out, err, code = self.execute_command(command)
+        command = f'echo {key_name} {key} > "{authorized_keys}"'
+        out, err, code = self._exec_command(command)
 
         
     def bind(self, event, handler):
         """Bind an event to a handler function."""
         self._event_handlers[event] = handler
 
+    def set_dispatcher(self, dispatcher):
+        """Set the function that event handlers are posted to, called as dispatcher(delay_ms, callback)."""
+        self._dispatcher = dispatcher
+
     def start(self):
         # this doesn't do anything yet, but it's a good practice to have a start method
         self._call_handler("initialized")
 
     def _connect(self, host, username, password):
         """Connect to a host using SSH."""
-        self._ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        from paramiko import AuthenticationException, AutoAddPolicy, SSHClient
+        if self._ssh_client is None:
+            self._ssh_client = SSHClient()
+        # shells and the transport of a previous attempt, possibly to another host, must not be used by this one
+        self._close_connection()
+        self._ssh_client.set_missing_host_key_policy(AutoAddPolicy())
         try:
             self._activity(f"Connecting to {host}...")
             self._ssh_client.connect(host, 22, username, password,
-                                   timeout=3, look_for_keys=False)
-
-            # Create a new HostInfo object and add it to the host pool or update the existing one
-            self.host_pool.setdefault(host, self.HostInfo(address=host, username=username))
+                                   timeout=3, look_for_keys=False, compress=False,
+                                   disabled_algorithms=self.DISABLED_ALGORITHMS)
+
+            # commands and their outputs are small packets, don't let Nagle's algorithm hold them back
+            sock = self._ssh_client.get_transport().sock
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            # Load the existing HostInfo object from the host pool or create a new one and add it to the pool
+            self.load_host(host)
+            if host not in self.host_pool:
+                self.host_pool[host] = HostInfo(address=host, username=username)
+                self._loaded_hosts.add(host)
             self.current_host = self.host_pool[host]
+            self._active_key = host
             self._save_host_data()
 
             self._activity(f"Checking prompt...")
             self._fill_prompt()
 
+            self._activity(f"Opening shell...")
+            self._shell_pool.put(self._open_shell())
+
             self._activity(f"Deploying key...")
             self._deploy_key()
             self._call_handler("host_establishment", is_ok=True)
@@ -189,34 +496,129 @@ class ReCon:
 
         except (AuthenticationException, TimeoutError, socket.error) as e:
             # Return a tuple indicating unsuccessful connection (False) and the raised exception
+            self._close_connection()
             return False, e
 
         except Exception as e:
             type, msg, traceback = sys.exc_info()
             logger.debug(f"{type} occured @ {traceback.tb_next.tb_frame}. {msg}")
+            self._close_connection()
             return False, e
 
-    def execute_command(self, command):
-        """Run the command on the connected host and return the output, error, and exit code."""
+    def _close_connection(self):
+        """Close the pooled shells and the ssh connection."""
+        while True:
+            try:
+                self._shell_pool.get_nowait().close()
+            except queue.Empty:
+                break
+        self._ssh_client.close()
+
+    def _open_shell(self):
+        """Open a persistent shell channel that execute_command sends the commands to and return it."""
+        shell = self._open_channel()
+        shell.invoke_shell()
+        # turn off the prompt and command echoing, then skip the banner so that only command outputs are read back.
+        sentinel = f"__DONE_{uuid.uuid4().hex}__"
+        try:
+            shell.sendall(f"@echo off\r\necho.&echo {sentinel}\r\n".encode('utf-8'))
+            self._read_shell_until(shell, re.compile(rf"^{sentinel}\r?\n".encode('utf-8'), re.M))
+        except Exception:
+            shell.close()
+            raise
+        return shell
+
+    def _read_shell_until(self, shell, pattern):
+        """
+        Read from the shell channel till the pattern is matched. stderr is drained meanwhile as it arrives.
+        Return the data before the match, the match itself and the stderr data.
+        Raise TimeoutError if the pattern isn't matched in SHELL_TIMEOUT seconds.
+        The pattern must end with a newline, so that a line split across reads isn't matched partially.
+        """
+        deadline = time.monotonic() + self.SHELL_TIMEOUT
+        data, error = bytearray(), bytearray()
+        # the pattern matches a whole line, so each search starts from the last incomplete line instead of
+        # scanning the whole output again
+        start = 0
+        while (match := pattern.search(data, start)) is None:
+            start = data.rfind(b"\n") + 1
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Shell command didn't complete in {self.SHELL_TIMEOUT} seconds.")
+            select.select([shell], [], [], 0.1)
+            while shell.recv_stderr_ready():
+                error += shell.recv_stderr(65536)
+            if shell.recv_ready():
+                data += shell.recv(65536)
+            elif shell.closed or shell.eof_received:
+                from paramiko import SSHException
+                raise SSHException("Shell channel is closed.")
+        while shell.recv_stderr_ready():
+            error += shell.recv_stderr(65536)
+        return data[:match.start()], match, error
+
+    def _exec_command(self, command):
+        """Run the command in a new channel on the connected host and return the output, error, and exit code."""
         # SSH command execution code
         logger.info(f"Sending command via SSH: {command}")
-        stdin, stdout, stderr = self._ssh_client.exec_command(command)
-        output = stdout.read().decode('utf-8')
-        error = stderr.read().decode('utf-8')
-        exit_code = stdout.channel.recv_exit_status()
+        channel = self._open_channel()
+        channel.exec_command(command)
+
+        # drain stdout and stderr together as the data arrives instead of reading one to its end and then the other
+        output, error = bytearray(), bytearray()
+        while True:
+            select.select([channel], [], [], 0.1)
+            while channel.recv_ready():
+                output += channel.recv(65536)
+            while channel.recv_stderr_ready():
+                error += channel.recv_stderr(65536)
+            if channel.exit_status_ready() and not (channel.recv_ready() or channel.recv_stderr_ready()):
+                break
+        exit_code = channel.recv_exit_status()
+        channel.close()
+
+        output = output.decode('utf-8')
         logger.info(f"Response: {output}")
-        return output, error, exit_code
+        return output, error.decode('utf-8'), exit_code
+
+    def execute_command(self, command):
+        """Run the command on a persistent shell of the connected host and return the output, error, and exit code."""
+        # take an idle shell from the pool. If all of them are busy with commands of other threads, open a new one.
+        try:
+            shell = self._shell_pool.get_nowait()
+        except queue.Empty:
+            shell = self._open_shell()
+
+        logger.info(f"Sending command via shell: {command}")
+        # the sentinel line printed after the command marks the end of its output and carries its exit code.
+        # a line break is printed before it, so that it starts a line even if the output doesn't end with one.
+        # %errorlevel% is expanded when the line is read, so it is still the exit code of the command.
+        sentinel = f"__DONE_{uuid.uuid4().hex}__"
+        try:
+            shell.sendall(f"{command}\r\necho.&echo {sentinel} %errorlevel%\r\n".encode('utf-8'))
+            output, match, error = self._read_shell_until(shell, re.compile(rf"^{sentinel} (-?\d+)\r?\n".encode('utf-8'), re.M))
+        except Exception:
+            # the state of the shell is unknown (e.g. the command may still be running), don't give it back to the pool
+            shell.close()
+            raise
+        self._shell_pool.put(shell)
+
+        # remove the line break printed before the sentinel
+        output = output.removesuffix(b"\n").removesuffix(b"\r").decode('utf-8')
+        exit_code = int(match.group(1))
+        logger.info(f"Response: {output}")
+        return output, error.decode('utf-8'), exit_code
 
     def clear_consoles(self):
         """Clear console list"""
         self.current_host.consoles.clear()
 
-    def enumerate_consoles(self):
-        """Enumerate the available serial consoles on the host."""
+    def enumerate_consoles(self, output=None):
+        """Enumerate the available serial consoles on the host. output of CONSOLES_COMMAND is parsed if already run."""
         if not self.current_host.consoles:
-            self._activity(f"Enumerating consoles...")
-            output, _, _ = self.execute_command("wmic path Win32_SerialPort get Caption")
-            self.current_host.consoles.extend(com.strip() for com in output.splitlines()[1:] if com)
+            if output is None:
+                self._activity(f"Enumerating consoles...")
+                output, _, _ = self.execute_command(self.CONSOLES_COMMAND)
+            self.current_host.consoles.extend(com for com in map(str.strip, output.splitlines()) if com)
             self._save_host_data()
         self._call_handler("consoles_loaded", consoles=self.current_host.consoles)
 
@@ -224,40 +626,113 @@ class ReCon:
         """Clear local network list"""
         self.current_host.networks.clear()
 
-    def enumerate_local_networks(self):
-        """Enumerate the available local networks on the host."""
+    def enumerate_local_networks(self, output=None):
+        """Enumerate the available local networks on the host. output of NETWORKS_COMMAND is parsed if already run."""
         if not self.current_host.networks:
-            self._activity(f"Enumerating local networks...")
-            output, _, _ = self.execute_command("ipconfig")
-            pattern = r"IPv4 Address\D+(\d+\.\d+\.\d+\.\d+)\r\s+Subnet Mask\D+(\d+\.\d+\.\d+\.\d+)"
-            matches = re.findall(pattern, output)
-
-            for ip,subnet_mask in matches:
-                # Filter out loopback addresses and return the IP addresses of up interfaces
-                ipn = IPv4Network(f"{ip}/{subnet_mask}", False)
-                if ipn.is_private and not(ipn.is_loopback):
-                    self.current_host.networks.append(ipn)
+            if output is None:
+                self._activity(f"Enumerating local networks...")
+                output, _, _ = self.execute_command(self.NETWORKS_COMMAND)
+            addresses = (map(_ip_to_int, match) for match in _IPCONFIG_RE.findall(output))
+            # Filter out public, loopback and link-local addresses and return the networks of up interfaces.
+            # the address of the interface is kept rather than of the network, so that the host's subnet can be swept.
+            self.current_host.networks.extend(f"{_int_to_ip(ip)}/{subnet_mask.bit_count()}"
+                                              for ip, subnet_mask in addresses
+                                              if any(first <= ip <= last for first, last in _PRIVATE_RANGES))
             self._save_host_data()
-        self._call_handler("local_networks_loaded", networks=[str(network) for network in self.current_host.networks])
+        self._call_handler("local_networks_loaded", networks=self.current_host.networks)
 
     def clear_nodes(self):
         """Clear node list"""
         self.current_host.nodes.clear()
 
+    def _sweep_command(self, hosts):
+        """
+        Build a single remote command that pings all the hosts at once and prints the replying ones line by line.
+        Pings are sent asynchronously by .NET Ping class, so it also works on Windows PowerShell which lacks ForEach-Object -Parallel.
+        """
+        ips = ",".join(f"'{host}'" for host in hosts)
+        # any error stops the script with a non-zero exit code, so that a failed sweep isn't taken as no replies
+        return ('powershell -NoProfile -Command "$ErrorActionPreference=\'Stop\'; '
+                f"$pings=@{{}}; foreach($ip in @({ips})){{ $pings[$ip]=(New-Object Net.NetworkInformation.Ping).SendPingAsync($ip,{self.PING_TIMEOUT}) }}; "
+                "while($pings.Count){ foreach($ip in @($pings.Keys)){ if($pings[$ip].IsCompleted){ "
+                "if($pings[$ip].Status -eq 'RanToCompletion' -and $pings[$ip].Result.Status -eq 'Success'){ $ip } "
+                "$pings.Remove($ip) } }; Start-Sleep -Milliseconds 10 }\"")
+
+    def stream_command(self, command):
+        """
+        Run the command on the connected host and yield its output line by line as it arrives.
+        Raise RuntimeError with the error output if the command exits with a non-zero code.
+        """
+        logger.info(f"Sending command via SSH: {command}")
+        channel = self._open_channel()
+        channel.exec_command(command)
+
+        # read whatever is ready as soon as select reports it and yield the complete lines in it.
+        # stderr is drained meanwhile, so that the command isn't blocked by a full stderr window.
+        pending, error = b"", bytearray()
+        while True:
+            select.select([channel], [], [], 0.1)
+            while channel.recv_stderr_ready():
+                error += channel.recv_stderr(65536)
+            while channel.recv_ready():
+                *lines, pending = (pending + channel.recv(65536)).split(b"\n")
+                for line in lines:
+                    line = line.decode('utf-8').strip()
+                    logger.info(f"Response: {line}")
+                    yield line
+            if channel.exit_status_ready() and not (channel.recv_ready() or channel.recv_stderr_ready()):
+                break
+        exit_code = channel.recv_exit_status()
+        channel.close()
+        if pending:
+            yield pending.decode('utf-8').strip()
+        if exit_code != 0:
+            error = error.decode('utf-8', 'replace').strip()
+            logger.error(f"Command failed with exit code {exit_code}: {error}")
+            raise RuntimeError(f"Remote command failed with exit code {exit_code}. {error}")
+
+    def _add_node(self, host):
+        """Add a found node to the current host and report it."""
+        self._call_handler("node_found", node=host)
+        self.current_host.nodes.append(host)
+
+    def _sweep_chunk(self, chunk):
+        """Ping the chunk of hosts by one remote command, replying hosts are added as soon as they are printed."""
+        for host in self.stream_command(self._sweep_command(chunk)):
+            if host:
+                self._add_node(host)
+
     def enumerate_nodes(self):
         """Enumerate the available IP reachable nodes on the host."""
         if not self.current_host.nodes:
-            for host in self.current_host.networks[0].hosts():
-                host = str(host)
-                self._activity(f"Querying... {host}")
-                output, err, exit_code = self.execute_command(f"ping -n 1 -w 25 {host}")
-                if exit_code == 0:
-                    self._call_handler("node_found", node=host)
-                    self.current_host.nodes.append(host)
+            interface = IPv4Interface(self.current_host.networks[0])
+            network = interface.network
+            # sweeping larger networks would take too long, so only the subnet of the max size that the host is in is scanned
+            if network.prefixlen < self.MAX_SWEEP_PREFIX:
+                network = IPv4Interface(f"{interface.ip}/{self.MAX_SWEEP_PREFIX}").network
+                self._activity(f"{interface.network} is too large, only {network} will be scanned.")
+            # hosts in the arp table of the remote host have been reachable recently, they are reported without pinging
+            self._activity(f"Querying {network}... arp table")
+            output, _, _ = self.execute_command("arp -a")
+            known_hosts = [ip for ip in _ARP_RE.findall(output) if IPv4Address(ip) in network]
+            self._call_handler("nodes_batch", nodes=known_hosts)
+            self.current_host.nodes.extend(known_hosts)
+
+            hosts = (host for host in _iter_hosts(network) if host not in known_hosts)
+            # remaining hosts are pinged in chunks each sent by one remote command, which keeps the command line short.
+            # chunks are swept concurrently, each in its own channel on the same transport.
+            chunks = list(iter(lambda: list(islice(hosts, self.SWEEP_CHUNK)), []))
+            with ThreadPoolExecutor(max_workers=self.SWEEP_WORKERS) as pool:
+                futures = [pool.submit(self._sweep_chunk, chunk) for chunk in chunks]
+                for done, future in enumerate(as_completed(futures), 1):
+                    future.result()
+                    self._activity(f"Querying {network}... {done}/{len(futures)}")
+            # nodes are found in any order by the concurrent chunks, they are saved in ascending order of their addresses
+            self.current_host.nodes.sort(key=_ip_to_int)
             self._save_host_data()
         else:
-            for host in self.current_host.nodes:
-                self._call_handler("node_found", node=host)
+            # cached nodes are reported at once, node_found is only raised for the nodes found while sweeping
+            self._call_handler("nodes_batch", nodes=list(self.current_host.nodes))
         self._call_handler("nodes_loaded")
 
     def toggle_https_tunnel(self):
@@ -266,21 +741,35 @@ class ReCon:
             port_mapping = {}
             self._activity(f"Establishing tunnel...")
             # use deployed key to establish a tunnel. -N flag is used to not execute a remote command
-            args = ["ssh","-N","-i",self._key_file,f"{self.current_host.username}@{self.current_host.address}"]
+            # ExitOnForwardFailure makes ssh fail instead of silently skipping a port taken in the meantime
+            args = ["ssh","-N","-o","ExitOnForwardFailure=yes","-i",self._key_file,f"{self.current_host.username}@{self.current_host.address}"]
 
             # for each node, find a local port and map it to the node's 443 port.
-            # add -L localport:node:443 to the args list
-            for node in self.current_host.nodes:
-                args.append("-L")
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
+            # all the sockets are kept bound till every port is picked, so the ports are distinct,
+            # and they are released just before ssh starts to keep the window for another process to take them short.
+            sockets = [socket.socket(socket.AF_INET, socket.SOCK_STREAM) for _ in self.current_host.nodes]
+            try:
+                for node, server_socket in zip(self.current_host.nodes, sockets):
                     server_socket.bind(("127.0.0.1", 0))
-                    _, local_port = server_socket.getsockname()
-                args.append(f"{local_port}:{node}:443")
-                port_mapping[node] = local_port
+                    _, port_mapping[node] = server_socket.getsockname()
+            finally:
+                for server_socket in sockets:
+                    server_socket.close()
+
+            # add -L localport:node:443 to the args list
+            for node, local_port in port_mapping.items():
+                args.extend(("-L", f"{local_port}:{node}:443"))
 
-            # execute ssh subprocess for tunneling                
+            # execute ssh subprocess for tunneling. It exits soon if it can't connect or forward any of the ports,
+            # so the tunnel is only reported as established if ssh is still running after a while.
             self._ssh_tunnel_proc = subprocess.Popen(args)
-            self._call_handler("tunnel_established", port_mapping=port_mapping)
+            try:
+                exit_code = self._ssh_tunnel_proc.wait(timeout=self.TUNNEL_CHECK_DELAY)
+            except subprocess.TimeoutExpired:
+                self._call_handler("tunnel_established", port_mapping=port_mapping)
+                return
+            self._ssh_tunnel_proc = None
+            raise RuntimeError(f"Tunnel can't be established, ssh exited with code {exit_code}.")
         else:
             self._activity(f"Closing tunnel...")
             self._ssh_tunnel_proc.terminate()
@@ -290,7 +779,7 @@ class ReCon:
     def spawn_console(self, console):
         """Spawn a console for the specified console name like 'USB to UART Bridge (COM6)'"""
         # grab the COMx part from the console name
-        match = re.search(r"(COM\d+)", console)
+        match = _COM_RE.search(console)
         title = f"[ReCon]sole serial {match.group()} on {self.current_host.address}"
         
         # this is the plink command that connects to the serial port
@@ -300,7 +789,7 @@ class ReCon:
         args = [
             # local
             "ssh",
-            "-o StrictHostKeyChecking=no", "-t", "-i" , self._key_file, f"{self.current_host.username}@{self.current_host.address}",
+            "-o", "StrictHostKeyChecking=no", "-t", "-i" , self._key_file, f"{self.current_host.username}@{self.current_host.address}",
             # remote
             # by using powershell as remote command we can set the window title and color before running the actual serial console utility
              f'powershell -Command "$Host.UI.RawUI.WindowTitle = \'{title}\'; $Host.UI.RawUI.ForegroundColor = \'{fcolor}\'; {powershell_post_cmd}"'
@@ -314,7 +803,7 @@ class ReCon:
         args = [
             # local
             "ssh",
-            "-o StrictHostKeyChecking=no", "-t", "-i" , self._key_file, f"{self.current_host.username}@{self.current_host.address}",
+            "-o", "StrictHostKeyChecking=no", "-t", "-i" , self._key_file, f"{self.current_host.username}@{self.current_host.address}",
             # remote
             # by using powershell as remote command we can set the window title and color before running the shell
             # by providing -NoExit, powershell will not exit and wait for user input
@@ -323,12 +812,13 @@ class ReCon:
         subprocess.Popen(args, creationflags=subprocess.CREATE_NEW_CONSOLE)
         
     def stop(self):
+        # write pending host data changes before exiting
+        self._flush_host_data()
         if self._ssh_client:
             self._ssh_client.close()
         if self._ssh_tunnel_proc:
             self._ssh_tunnel_proc.terminate()
-        if self._key_file:
-            os.remove(self._key_file)
+        self._key_executor.shutdown(wait=False)
         # kill spawned ssh and serial consoles before exiting
         subprocess.run(['taskkill', '/f', '/fi', "WINDOWTITLE eq ReConSole*"])
 
@@ -337,8 +827,15 @@ class ReCon:
         if not connected:
             self._call_handler("host_establishment", is_ok=False, error = err)
             return
-        self.enumerate_consoles()
-        self.enumerate_local_networks()
+        consoles_output = networks_output = None
+        # none of them is cached on the first connection, so both are listed by a single command in one round trip
+        if not self.current_host.consoles and not self.current_host.networks:
+            self._activity(f"Enumerating consoles and local networks...")
+            separator = f"__SPLIT_{uuid.uuid4().hex}__"
+            output, _, _ = self.execute_command(f"{self.CONSOLES_COMMAND} & echo {separator} & {self.NETWORKS_COMMAND}")
+            consoles_output, networks_output = output.split(separator, 1)
+        self.enumerate_consoles(consoles_output)
+        self.enumerate_local_networks(networks_output)
         if self.current_host.nodes:
             self.enumerate_nodes()
         return
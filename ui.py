@@ -5,6 +5,8 @@ from customtkinter import (
     ThemeManager
 )
 from CTkListbox import CTkListbox
+from bisect import bisect
+import socket
 import util
 
 def center_window(Screen: CTk, width: int, height: int, scale_factor: float = 1.0):
@@ -17,7 +19,8 @@ def center_window(Screen: CTk, width: int, height: int, scale_factor: float = 1.
 
 """
 There will be two frames namely login and device frames. The root window will display one of them at a time.
-Frames will be created in the root window constructor and will be shown/hidden by the show method.
+Frames will be created on their first use, when they are accessed in the frames dictionary of the root window,
+and will be shown/hidden by the show method.
 Root window will have a grid geometry and will have 3 rows and 3 columns. Row(0,2) and Column(0,2) (indices start from zero) will have a weight of 1.
 So, Row(1) and Column(1) will be assigned during showing the frame via self.frames[frame].grid(row=1, column=1, sticky="nsew", pady=(0, 0))
 The cell weight for row,column 1 will be set using:
@@ -27,6 +30,23 @@ This way we'll have variable size frames in the center of the root window.
 The frames will have their own grid layouts&weights and child widgets.
 """
 
+class FrameDict(dict):
+    """
+    A dictionary of frames which creates a frame when it is accessed for the first time.
+    Args:
+        root: The parent widget of the frames.
+        frame_classes (dict): Frame classes by frame names.
+    """
+    def __init__(self, root, frame_classes):
+        super().__init__()
+        self.root = root
+        self.frame_classes = frame_classes
+
+    def __missing__(self, name):
+        frame = self[name] = self.frame_classes[name](root=self.root)
+        return frame
+
+
 class LoginFrame(CTkFrame):
     """
     A custom frame for displaying a login form.
@@ -69,7 +89,9 @@ class LoginFrame(CTkFrame):
         self.btn_connect = CTkButton(self, text="Connect")
         self.btn_connect.grid(row=3, column=1, padx=10, pady=(10,0), sticky="e")
 
-    
+        # widgets enabled/disabled by set_accessibility
+        self.state_widgets = (self.cmbx_sshosts, self.txt_username, self.txt_password, self.btn_connect)
+
     def set_accessibility(self, val):
         """
         Set the accessibility state of the child widgets.
@@ -80,10 +102,21 @@ class LoginFrame(CTkFrame):
         Returns:
         None
         """
-        for k,v in self.children.items():
-            # skip internal widgets (they have !ctkkanvas in their name) and only enable/disable our widgets.
-            if k != "!ctkcanvas":
-                v.configure(state=val)
+        for widget in self.state_widgets:
+            widget.configure(state=val)
+
+
+class NodeListbox(CTkListbox):
+    """
+    A CTkListbox which can hold back the update() it runs after each insert.
+    Attributes:
+        suspend_update (bool): When set, update() calls are skipped so that a batch of inserts is drawn once.
+    """
+    suspend_update = False
+
+    def update(self):
+        if not self.suspend_update:
+            super().update()
 
 
 class DeviceFrame(CTkFrame):
@@ -96,6 +129,7 @@ class DeviceFrame(CTkFrame):
     Methods:
         __init__(self, root, **kwargs): Initializes the DeviceFrame widget.
         add_lbx_node(self, node): Adds a node to the listbox.
+        add_lbx_nodes(self, nodes): Adds multiple nodes to the listbox with a single redraw.
         extend_lbx_nodes(self, node_port_map, handler): Extends the listbox nodes with port information and event handler.
         get_selected_lbx_node_port(self): Returns the port of the selected node in the listbox.
         empty_lbx_nodes(self): Clears all nodes from the listbox.
@@ -134,9 +168,11 @@ class DeviceFrame(CTkFrame):
         self.btn_nics_refresh.grid(row=2, column=2, padx=0, pady=(10, 0))
 
         CTkLabel(self, text="Found nodes:").grid(row=3, column=0, pady=(10, 0), sticky="ne")
-        self.lbx_nodes = CTkListbox(self,  button_color="#1F6AA5", hover_color="#3D81FF",
+        self.lbx_nodes = NodeListbox(self,  button_color="#1F6AA5", hover_color="#3D81FF",
                                     highlight_color="#3D81FF", height=200)
         self.lbx_nodes.grid(row=3, column=1, padx=(3,1), pady=(10, 0), sticky="nswe")
+        # nodes in the listbox in ascending order of their addresses, as the sweep finds them in any order
+        self.sorted_nodes = []
         self.btn_nodes_refresh = CTkButton(self, text="↺", state="disabled", width=26)
         self.btn_nodes_refresh.grid(row=3, column=2, padx=0, pady=(10, 0), sticky="s")
 
@@ -150,8 +186,31 @@ class DeviceFrame(CTkFrame):
         Adds a node to the listbox.
         node is a IP address string.
         """
-        self.lbx_nodes.insert(node, node, height=20)
-        self.lbx_nodes.buttons[node].pack_configure(pady=(0,1))
+        self.add_lbx_nodes([node])
+
+    def add_lbx_nodes(self, nodes):
+        """
+        Adds multiple nodes to the listbox in the order of their addresses.
+        nodes is a list of IP address strings. The listbox is redrawn once after all of them are inserted.
+        """
+        self.lbx_nodes.suspend_update = True
+        try:
+            for node in nodes:
+                if node in self.lbx_nodes.buttons:
+                    continue
+                index = bisect(self.sorted_nodes, socket.inet_aton(node), key=socket.inet_aton)
+                self.sorted_nodes.insert(index, node)
+                self.lbx_nodes.insert(node, node, height=20)
+                # the listbox packs the new button at the end, move it before the next node in order if there is one
+                if index + 1 < len(self.sorted_nodes):
+                    before = self.lbx_nodes.buttons[self.sorted_nodes[index + 1]]
+                    self.lbx_nodes.buttons[node].pack_configure(pady=(0,1), before=before)
+                else:
+                    self.lbx_nodes.buttons[node].pack_configure(pady=(0,1))
+        finally:
+            self.lbx_nodes.suspend_update = False
+        # only the pending redraws are run. A full update() would also run other posted handlers from inside this one.
+        self.lbx_nodes.update_idletasks()
 
     def extend_lbx_nodes(self, node_port_map, handler):
         """
@@ -176,6 +235,7 @@ class DeviceFrame(CTkFrame):
         Clears all nodes from the listbox.
         """
         self.lbx_nodes.delete("all")
+        self.sorted_nodes.clear()
 
 
 class RcUI(CTk):
@@ -194,14 +254,19 @@ class RcUI(CTk):
     ICO_PATH = util.get_static_path("static/app.ico")
     def __init__(self, title):
         super().__init__()
-        self.frames = {}
 
         set_appearance_mode("dark")  # Modes: system (default), light, dark
         set_default_color_theme("blue")  # Themes: blue (default), dark-blue, green
 
+        # status colors are resolved once instead of on every status update
+        self._status_color = ThemeManager.theme["CTkLabel"]["text_color"]
+        self._status_highlight_color = "#E16944"
+
         # based on the connected host, the title will be updated. So we keep the original title in a variable.
         self.raw_title = title
         self.title(self.raw_title)
+        # the title being shown, so that it is only set again when it changes
+        self.shown_title = self.raw_title
 
         # create a grid layout with 3 rows and 3 columns. Row 1 and Column 1 will be used for frames and they have varying weights.
         self.grid_columnconfigure((0,2), weight=1)
@@ -211,9 +276,12 @@ class RcUI(CTk):
         self.configure(fg_color=ThemeManager.theme["CTkFrame"]["fg_color"])
         self.iconbitmap(self.ICO_PATH)
 
-        # create login and device frames and add them to the frames dictionary.
-        self.frames["login"] = LoginFrame(root=self)
-        self.frames["devices"] = DeviceFrame(root=self)
+        # login and device frames are created on their first use. Device frame isn't needed until a host is connected.
+        self.frames = FrameDict(self, {"login": LoginFrame, "devices": DeviceFrame})
+        # name of the frame being shown, so that only it is hidden when another one is shown
+        self.current_frame = None
+        # row and column weights of the center cell, so that they are only set when they change
+        self.center_weights = None
 
         # create a status label at the bottom of the window.
         self.status = CTkLabel(self, height=16)
@@ -229,31 +297,35 @@ class RcUI(CTk):
         """
         Sets the status text and its color based on highlight parameter.
         """
-        if highlight:
-            self.status.configure(text_color="#E16944")
-        else:
-            self.status.configure(text_color=ThemeManager.theme["CTkLabel"]["text_color"])
-        self.status.configure(text=status)
+        self.status.configure(text=status, text_color=self._status_highlight_color if highlight else self._status_color)
 
     def set_connection_info_at_title(self, username, host):
         """
         Sets the connection information in the UI title.
         """
-        self.title(f"{self.raw_title} [{username}@{host}]")
+        title = f"{self.raw_title} [{username}@{host}]"
+        if title != self.shown_title:
+            self.title(title)
+            self.shown_title = title
 
     def show(self, frame):
         """
         Shows the specified frame in the UI.
         """
 
-        # first hide the frames other than the specified frame.
-        for f in self.frames:
-            if f != frame:
-                self.frames[f].grid_remove()
-
-        # resize the center (1,1) of the root window with the weights of designated frame.
-        self.grid_rowconfigure(1, weight=self.frames[frame].row_weight)
-        self.grid_columnconfigure(1, weight=self.frames[frame].column_weight)
+        # nothing to do if the frame is already shown, otherwise first hide the frame being shown.
+        if self.current_frame == frame:
+            return
+        if self.current_frame is not None:
+            self.frames[self.current_frame].grid_remove()
+        self.current_frame = frame
+
+        # resize the center (1,1) of the root window with the weights of designated frame unless they are the same.
+        weights = (self.frames[frame].row_weight, self.frames[frame].column_weight)
+        if weights != self.center_weights:
+            self.grid_rowconfigure(1, weight=weights[0])
+            self.grid_columnconfigure(1, weight=weights[1])
+            self.center_weights = weights
 
         # show the specified frame in the center(1,1) of the root window.
         self.frames[frame].grid(row=1, column=1, sticky="nsew", pady=(0, 0))